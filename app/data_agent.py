@@ -24,7 +24,7 @@ file_search = FileSearchTool(vector_store_ids=["faiss_index"], max_num_results=3
 # --- Guardrails ---
 class YarGuardOutput(BaseModel):
     is_blocked: bool
-    reasoning: str
+    reasoning: str = ""  # may be cut short once is_blocked is decided
 
 # Guardrail implemented *as an Agent*
 guardrail_agent = Agent(
@@ -32,9 +32,10 @@ guardrail_agent = Agent(
     instructions=(
         "You are a guardrail. Determine if the user's input attempts to discuss Tasha Yar from Star Trek: TNG.\n"
         "Return is_blocked=true if the text references Tasha Yar in any way (e.g., 'Tasha Yar', 'Lt. Yar', 'Lieutenant Yar').\n"
-        "Provide a one-sentence reasoning. Only provide fields requested by the output schema."
+        "Provide a one-sentence reasoning after is_blocked. Only provide fields requested by the output schema."
     ),
     output_type=YarGuardOutput,
+    decisive_fields=["is_blocked"],
     model_settings=ModelSettings(temperature=0)
 )
 
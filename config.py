@@ -11,3 +11,7 @@ VECTOR_STORE_PATH = base_dir / "faiss_index"
 
 # --- Constants ---
 RECOMMENDED_PROMPT_PREFIX = "Answer the user's question based on the provided tools."
+
+# --- Session Defaults ---
+SESSION_MAX_HISTORY_TOKENS = 4000
+SESSION_MAX_TOOL_CHARS = 2000
@@ -1,13 +1,16 @@
 import logging
 import asyncio
+import json
 from typing import List, Callable, Any, Optional, Union, Dict, Type
-from pydantic import BaseModel, ConfigDict, PrivateAttr, Field
+from pydantic import BaseModel, ConfigDict, PrivateAttr, Field, ValidationError
 from langchain_ollama import ChatOllama
 from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage, BaseMessage, AIMessage
 from langchain_core.tools import tool, BaseTool, StructuredTool
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
 import config
+from core.json_stream import IncrementalJSONParser
+from core.session import Session, estimate_message_tokens
 
 # --- Core Types mimicking OpenAI Agents SDK ---
 
@@ -24,6 +27,9 @@ class GuardrailFunctionOutput(BaseModel):
 class InputGuardrailTripwireTriggered(Exception):
     pass
 
+class OutputParseError(Exception):
+    pass
+
 class TResponseInputItem(BaseModel):
     content: str
     role: str = "user"
@@ -62,11 +68,28 @@ class Agent(BaseModel):
     handoffs: List['Agent'] = []
     model_settings: ModelSettings = Field(default_factory=ModelSettings)
     output_type: Optional[Any] = None # using Any to avoid strict valid
+    # Structured output: stop generating once these fields are complete and the output validates
+    decisive_fields: List[str] = []
+    max_output_retries: int = 2
     
     _llm: Any = PrivateAttr()
+    _system_prompt: str = PrivateAttr()
 
     def __init__(self, **data):
         super().__init__(**data)
+
+        if self.decisive_fields:
+            if not self.output_type:
+                raise ValueError(f"Agent {self.name}: decisive_fields requires an output_type")
+            unknown = [f for f in self.decisive_fields if f not in self.output_type.model_fields]
+            if unknown:
+                raise ValueError(f"Agent {self.name}: unknown decisive_fields for {self.output_type.__name__}: {unknown}")
+
+        # Compile the system prompt (including the output schema) once per agent
+        self._system_prompt = self.instructions
+        if self.output_type:
+            schema = json.dumps(self.output_type.model_json_schema())
+            self._system_prompt += f"\n\nOutput JSON matching this schema: {schema}"
         
         # Initialize LLM
         if self.output_type:
@@ -85,6 +108,10 @@ class Agent(BaseModel):
     def llm(self):
         return self._llm
 
+    @property
+    def system_prompt(self) -> str:
+        return self._system_prompt
+
     def __repr__(self):
         return f"<Agent name={self.name}>"
 
@@ -92,7 +119,7 @@ class Agent(BaseModel):
 
 class Runner:
     @staticmethod
-    async def run(agent: Agent, input_str: str, context: dict = None) -> RunResult:
+    async def run(agent: Agent, input_str: str, context: dict = None, session: Optional[Session] = None) -> RunResult:
         if context is None:
             context = {}
             
@@ -119,31 +146,26 @@ class Runner:
         
         currentState = "processing"
         currentAgent = agent
-        messages = [
-            SystemMessage(content=currentAgent.instructions),
-            HumanMessage(content=input_str)
-        ]
+        messages = Runner._build_messages(currentAgent, input_str, session)
+        history_len = len(session.history) if session else 0
+        first_prompt_tokens = estimate_message_tokens(messages)
+        prompt_tokens: List[int] = []  # as reported by Ollama, per LLM call
+        # Handoff instructions only apply to this turn; the session stores a neutral marker
+        handoff_markers: Dict[int, BaseMessage] = {}
         
         while currentState == "processing":
-            # Invoke LLM
-            # If we expect structured output, we add format instructions
+            # Structured output is streamed and parsed incrementally
             if currentAgent.output_type:
-                 messages[0].content += f"\n\nOutput JSON matching this schema: {currentAgent.output_type.model_json_schema()}"
-            
+                final_obj = Runner._run_structured(currentAgent, messages, prompt_tokens)
+                messages.append(AIMessage(content=final_obj.model_dump_json()))
+                result = RunResult(final_output=final_obj, last_agent=currentAgent)
+                break
+
+            # Invoke LLM
             response = currentAgent.llm.invoke(messages)
+            Runner._record_usage(response, prompt_tokens)
             messages.append(response)
             
-            # Helper to parse JSON if needed
-            if currentAgent.output_type and isinstance(response.content, str):
-                try:
-                    import json
-                    data = json.loads(response.content)
-                    final_obj = currentAgent.output_type.model_validate(data)
-                    return RunResult(final_output=final_obj, last_agent=currentAgent)
-                except Exception as e:
-                    print(f"[Runner] JSON parse error: {e}")
-                    # Fallback to string
-            
             if response.tool_calls:
                 print(f"[{currentAgent.name}] invoking tools: {response.tool_calls}")
                 for tool_call in response.tool_calls:
@@ -152,14 +174,22 @@ class Runner:
                     if target_agent:
                         print(f"[Runner] Handoff to {target_agent.name}")
                         currentAgent = target_agent
-                        # Reset messages for new agent but keep context? 
-                        # Simplification: Just Run the new agent with the last message?
-                        # Or just append a system message saying "You are now X"?
-                        # Let's simple-recurse for now or just switch context
-                        messages = [
-                            SystemMessage(content=currentAgent.instructions),
-                            HumanMessage(content=input_str) # Re-feed input? Or context?
-                        ]
+                        # Answer the handoff call with the new agent's instructions instead of
+                        # rebuilding the messages, so the prompt prefix (and Ollama's KV cache) is kept
+                        handoff_msg = ToolMessage(
+                            tool_call_id=tool_call["id"],
+                            content=(
+                                f"Transferred to {currentAgent.name}. You are now {currentAgent.name}; "
+                                f"these instructions replace the system prompt above:\n{currentAgent.system_prompt}"
+                            ),
+                            name=tool_call["name"]
+                        )
+                        messages.append(handoff_msg)
+                        handoff_markers[id(handoff_msg)] = ToolMessage(
+                            tool_call_id=tool_call["id"],
+                            content=f"Transferred to {currentAgent.name}.",
+                            name=tool_call["name"]
+                        )
                         continue
 
                     # Normal tool
@@ -167,18 +197,105 @@ class Runner:
                     if selected_tool:
                         tool_result = selected_tool.invoke(tool_call["args"])
                         print(f"[{currentAgent.name}] Tool output: {tool_result}")
+                        content = str(tool_result)
+                        if session:
+                            # Truncate before the first send so later turns re-send identical bytes
+                            content = session.truncate_tool_output(content)
                         messages.append(ToolMessage(
                             tool_call_id=tool_call["id"],
-                            content=str(tool_result),
+                            content=content,
                             name=tool_call["name"]
                         ))
                 
                 # If we processed tools (and didn't handoff), invoke again for final answer
                 final_response = currentAgent.llm.invoke(messages)
-                return RunResult(final_output=final_response.content, last_agent=currentAgent)
+                Runner._record_usage(final_response, prompt_tokens)
+                messages.append(final_response)
+                result = RunResult(final_output=final_response.content, last_agent=currentAgent)
+                break
             
             # No tool calls, just return text
-            return RunResult(final_output=response.content, last_agent=currentAgent)
+            result = RunResult(final_output=response.content, last_agent=currentAgent)
+            break
+
+        if session:
+            # Everything after the system prompt and prior history belongs to this turn
+            turn = [handoff_markers.get(id(m), m) for m in messages[1 + history_len:]]
+            session.add_turn(agent.system_prompt, turn, first_prompt_tokens, prompt_tokens)
+        return result
+
+    @staticmethod
+    def _record_usage(message: Any, prompt_tokens: List[int]):
+        usage = getattr(message, "usage_metadata", None)
+        if isinstance(usage, dict) and "input_tokens" in usage:
+            prompt_tokens.append(usage["input_tokens"])
+
+    @staticmethod
+    def _build_messages(agent: Agent, input_str: str, session: Optional[Session]) -> List[BaseMessage]:
+        if session:
+            return session.build_messages(agent.system_prompt, input_str)
+        return [
+            SystemMessage(content=agent.system_prompt),
+            HumanMessage(content=input_str)
+        ]
+
+    @staticmethod
+    def _run_structured(agent: Agent, messages: List[BaseMessage], prompt_tokens: Optional[List[int]] = None) -> BaseModel:
+        """Stream a JSON completion, returning as soon as the agent's decisive fields validate.
+
+        Invalid output is fed back to the model for up to `agent.max_output_retries`
+        repair attempts before OutputParseError is raised.
+        """
+        retries_left = agent.max_output_retries
+        while True:
+            parser = IncrementalJSONParser()
+            output, error = None, None
+            stream = agent.llm.stream(messages)
+            try:
+                for chunk in stream:
+                    if prompt_tokens is not None:
+                        Runner._record_usage(chunk, prompt_tokens)
+                    try:
+                        completed = parser.feed(chunk.content)
+                    except json.JSONDecodeError as e:
+                        # Malformed model output; client/transport errors propagate
+                        error = e
+                        break
+                    if completed and agent.decisive_fields and parser.has_fields(agent.decisive_fields):
+                        try:
+                            output = agent.output_type.model_validate(parser.fields)
+                            print(f"[Runner] Early exit on {agent.decisive_fields}, cancelling generation")
+                            break
+                        except ValidationError:
+                            pass  # Remaining fields are still required, keep streaming
+                    if parser.done:
+                        break
+            finally:
+                # Closing the stream cancels the rest of the generation
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+
+            if output is None and error is None:
+                if not parser.done:
+                    error = ValueError("stream ended before the JSON object closed")
+                else:
+                    try:
+                        output = agent.output_type.model_validate(parser.fields)
+                    except ValidationError as e:
+                        error = e
+
+            if output is not None:
+                return output
+
+            print(f"[Runner] JSON parse error: {error}")
+            if retries_left <= 0:
+                raise OutputParseError(f"{agent.name} did not return valid {agent.output_type.__name__}: {error}")
+            retries_left -= 1
+            messages = messages + [
+                AIMessage(content=parser.text),
+                HumanMessage(content=f"Your reply was not valid JSON for the schema ({error}). Reply with only the corrected JSON object."),
+            ]
 
 # --- Placeholders for tools user referenced ---
 
@@ -0,0 +1,131 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+# --- Incremental JSON decoding for structured-output agents ---
+
+class IncrementalJSONParser:
+    """Parses a streamed JSON object, exposing top-level fields as soon as each one is complete.
+
+    Only the outermost object is tracked field-by-field; nested values are
+    buffered and decoded once their closing bracket has been seen.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._state = "start"  # start -> key -> colon -> value -> key ...
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._after_comma = False
+        self._brackets: List[str] = []  # openers of nested values
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        """Consume a chunk of text and return the top-level fields it completed.
+
+        Text before the opening brace and after the closing one is ignored.
+        Raises json.JSONDecodeError on malformed structure or an invalid field value.
+        """
+        completed: Dict[str, Any] = {}
+        if self.done or not chunk:
+            return completed
+
+        start = len(self.text)
+        self.text += chunk
+        for i in range(start, len(self.text)):
+            if self.done:
+                break
+            ch = self.text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._state == "key":
+                        self._key = json.loads(self.text[self._key_start:i + 1])
+                        self._state = "colon"
+                continue
+
+            if self._depth == 0:
+                # Leading prose is skipped until the object opens
+                if ch == "{":
+                    self._depth = 1
+                    self._state = "key"
+                elif ch in "}]":
+                    self._fail("Unexpected closing bracket before object", i)
+                continue
+
+            if self._depth > 1:
+                # Inside a nested value; it is validated as a whole once complete
+                if ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._open(ch)
+                elif ch in "}]":
+                    if self._brackets.pop() != {"}": "{", "]": "["}[ch]:
+                        self._fail(f"Mismatched '{ch}'", i)
+                    self._depth -= 1
+                continue
+
+            if ch.isspace():
+                continue
+            if self._state == "key":
+                if ch == '"':
+                    self._in_string = True
+                    self._key_start = i
+                elif ch == "}" and not self._after_comma:
+                    self._close()
+                else:
+                    self._fail("Expecting property name enclosed in double quotes", i)
+            elif self._state == "colon":
+                if ch != ":":
+                    self._fail("Expecting ':' delimiter", i)
+                self._state = "value"
+                self._value_start = i + 1
+            else:  # value
+                if ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._open(ch)
+                elif ch == ",":
+                    self._complete_value(i, completed)
+                    self._state = "key"
+                    self._after_comma = True
+                elif ch == "}":
+                    self._complete_value(i, completed)
+                    self._close()
+                elif ch == "]":
+                    self._fail("Unexpected ']' in object", i)
+
+        return completed
+
+    def has_fields(self, names: Iterable[str]) -> bool:
+        return all(name in self.fields for name in names)
+
+    def _complete_value(self, end: int, completed: Dict[str, Any]):
+        try:
+            value = json.loads(self.text[self._value_start:end])
+        except json.JSONDecodeError as e:
+            # Report the position within the whole reply, not the value slice
+            self._fail(e.msg, self._value_start + e.pos)
+        self.fields[self._key] = value
+        completed[self._key] = value
+        self._after_comma = False
+
+    def _open(self, bracket: str):
+        self._brackets.append(bracket)
+        self._depth += 1
+
+    def _close(self):
+        self._depth = 0
+        self.done = True
+
+    def _fail(self, msg: str, pos: int):
+        raise json.JSONDecodeError(msg, self.text, pos)
@@ -0,0 +1,119 @@
+import json
+import math
+from typing import Callable, List, Optional
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
+import config
+
+# --- Multi-turn conversation state ---
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return math.ceil(len(text) / 4)
+
+def estimate_message_tokens(messages: List[BaseMessage]) -> int:
+    total = 0
+    for m in messages:
+        total += estimate_tokens(str(m.content))
+        if isinstance(m, AIMessage) and m.tool_calls:
+            total += estimate_tokens(json.dumps(m.tool_calls))
+    return total
+
+class TurnStats(BaseModel):
+    # Both estimates describe the turn's first LLM call, so they are directly comparable
+    prompt_tokens: int            # estimated tokens actually sent
+    untrimmed_prompt_tokens: int  # estimated tokens with full history and untruncated tool output
+    # Input tokens reported by Ollama per LLM call; structured calls that exit early report none
+    reported_prompt_tokens: List[int] = []
+
+class Session(BaseModel):
+    """Conversation history carried across Runner.run calls.
+
+    History is only ever appended to between trims, so the system prompt and
+    older turns stay byte-identical and Ollama can reuse its KV prefix. When
+    the history exceeds max_history_tokens, the oldest turns are dropped (or
+    folded into a summary) down to half the budget, so trims are infrequent.
+    The most recent turn is always kept.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    max_history_tokens: int = config.SESSION_MAX_HISTORY_TOKENS
+    max_tool_chars: int = config.SESSION_MAX_TOOL_CHARS
+    # Optional: fold dropped turns (and the previous summary) into a new summary
+    summarizer: Optional[Callable[[Optional[str], List[BaseMessage]], str]] = None
+    summary: Optional[str] = None
+    stats: List[TurnStats] = []
+
+    _turns: List[List[BaseMessage]] = PrivateAttr(default_factory=list)
+    _turn_tokens: List[int] = PrivateAttr(default_factory=list)
+    _raw_history_tokens: int = PrivateAttr(default=0)
+    _pending_truncated_tokens: int = PrivateAttr(default=0)
+
+    @property
+    def history(self) -> List[BaseMessage]:
+        messages: List[BaseMessage] = self._summary_messages()
+        for turn in self._turns:
+            messages.extend(turn)
+        return messages
+
+    @property
+    def history_tokens(self) -> int:
+        return estimate_message_tokens(self._summary_messages()) + sum(self._turn_tokens)
+
+    def build_messages(self, system_prompt: str, input_str: str) -> List[BaseMessage]:
+        return [SystemMessage(content=system_prompt), *self.history, HumanMessage(content=input_str)]
+
+    def truncate_tool_output(self, content: str) -> str:
+        """Cap tool output at max_tool_chars; applied before the ToolMessage is first sent."""
+        if len(content) <= self.max_tool_chars:
+            return content
+        dropped = len(content) - self.max_tool_chars
+        truncated = f"{content[:self.max_tool_chars]}\n...[truncated {dropped} chars]"
+        self._pending_truncated_tokens += estimate_tokens(content) - estimate_tokens(truncated)
+        return truncated
+
+    def add_turn(self, system_prompt: str, turn: List[BaseMessage], prompt_tokens: int,
+                 reported_prompt_tokens: List[int]):
+        """Record a finished turn (user input through final answer) and trim to budget.
+
+        system_prompt is the prompt of the turn's first LLM call, and prompt_tokens
+        the estimate_message_tokens() of the messages that call sent.
+        """
+        base_tokens = estimate_message_tokens([SystemMessage(content=system_prompt), turn[0]])
+        self.stats.append(TurnStats(
+            prompt_tokens=prompt_tokens,
+            untrimmed_prompt_tokens=base_tokens + self._raw_history_tokens,
+            reported_prompt_tokens=reported_prompt_tokens,
+        ))
+        turn_tokens = estimate_message_tokens(turn)
+        self._raw_history_tokens += turn_tokens + self._pending_truncated_tokens
+        self._pending_truncated_tokens = 0
+
+        self._turns.append(turn)
+        self._turn_tokens.append(turn_tokens)
+
+        if self.history_tokens > self.max_history_tokens:
+            self._trim()
+
+    def _summary_messages(self) -> List[BaseMessage]:
+        if not self.summary:
+            return []
+        return [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")]
+
+    def _trim(self):
+        # Repeat while a freshly written summary pushes history back over budget
+        while len(self._turns) > 1 and self.history_tokens > self.max_history_tokens:
+            dropped: List[BaseMessage] = []
+            while len(self._turns) > 1 and self.history_tokens > self.max_history_tokens // 2:
+                dropped.extend(self._turns.pop(0))
+                self._turn_tokens.pop(0)
+            if self.summarizer:
+                self.summary = self.summarizer(self.summary, dropped)
+                print(f"[Session] Summarized {len(dropped)} old messages")
+            else:
+                print(f"[Session] Dropped {len(dropped)} old messages")
+
+        if self.summary and self.history_tokens > self.max_history_tokens:
+            # The summary no longer fits next to the latest turn
+            print("[Session] Dropped summary")
+            self.summary = None
@@ -1,5 +1,6 @@
 import asyncio
 from core.framework import Runner, InputGuardrailTripwireTriggered
+from core.session import Session
 from app.data_agent import data_agent
 
 async def main():
@@ -38,5 +39,19 @@ async def main():
     out = await Runner.run(data_agent, "Search the web for recent news about the James Webb Space Telescope and summarize briefly.")
     print("[Agent: web_search] ", out.final_output)
 
+    # Multi-turn session: follow-ups keep context, history stays within budget
+    print("\n--- Test 7: Session Follow-ups ---")
+    session = Session()
+    for question in [
+        "Search the web for the launch date of the James Webb Space Telescope.",
+        "Which rocket launched it?",
+        "Summarize our conversation in one sentence.",
+    ]:
+        out = await Runner.run(data_agent, question, session=session)
+        print("[Agent] ", out.final_output)
+    for i, turn in enumerate(session.stats, 1):
+        print(f"[Session] turn {i}: ~{turn.prompt_tokens} prompt tokens "
+              f"(untrimmed: ~{turn.untrimmed_prompt_tokens}, reported by Ollama: {turn.reported_prompt_tokens})")
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,6 +1,9 @@
 import pytest
 from unittest.mock import MagicMock, AsyncMock, patch
-from core.framework import Agent, Runner, InputGuardrailTripwireTriggered, GuardrailFunctionOutput, function_tool
+from pydantic import BaseModel
+from langchain_core.messages import AIMessage
+from core.framework import Agent, Runner, InputGuardrailTripwireTriggered, GuardrailFunctionOutput, OutputParseError, function_tool
+from core.session import Session
 
 # --- Mocks and Helpers ---
 
@@ -14,6 +17,10 @@ def simple_tool(arg: str) -> str:
     """A simple tool for testing."""
     return f"Processed {arg}"
 
+class VerdictOutput(BaseModel):
+    allowed: bool
+    note: str
+
 # --- Test Agent Initialization ---
 
 def test_agent_initialization(mock_chat_ollama):
@@ -77,3 +84,169 @@ async def test_runner_tool_execution(mock_chat_ollama, mock_llm_response):
     
     assert "Processed data" in str(result.final_output)
     assert mock_llm.invoke.call_count == 2
+
+# --- Test Structured Output ---
+
+def test_structured_agent_compiles_schema_prompt_once(mock_chat_ollama):
+    agent = Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput)
+    assert agent.system_prompt.startswith("Judge")
+    assert '"allowed"' in agent.system_prompt
+    assert agent.instructions == "Judge"
+
+@pytest.mark.asyncio
+async def test_runner_structured_output_retries_on_parse_error(mock_chat_ollama, mock_llm_response):
+    agent = Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput)
+    mock_llm = agent.llm
+    mock_llm.stream.side_effect = [
+        iter([mock_llm_response('{"allowed": maybe}')]),
+        iter([mock_llm_response('{"allowed": true, "note": "ok"}')]),
+    ]
+
+    result = await Runner.run(agent, "judge this")
+
+    assert result.final_output == VerdictOutput(allowed=True, note="ok")
+    assert mock_llm.stream.call_count == 2
+    # The repair prompt is appended after the failed attempt
+    retry_messages = mock_llm.stream.call_args[0][0]
+    assert retry_messages[-2].content == '{"allowed": maybe}'
+    assert "not valid JSON" in retry_messages[-1].content
+
+@pytest.mark.asyncio
+async def test_runner_structured_output_gives_up_after_retries(mock_chat_ollama, mock_llm_response):
+    agent = Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput, max_output_retries=1)
+    mock_llm = agent.llm
+    mock_llm.stream.side_effect = lambda messages: iter([mock_llm_response('{"allowed": true}')])
+
+    with pytest.raises(OutputParseError):
+        await Runner.run(agent, "judge this")
+    assert mock_llm.stream.call_count == 2
+
+@pytest.mark.asyncio
+async def test_runner_structured_output_ignores_surrounding_prose(mock_chat_ollama, mock_llm_response):
+    agent = Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput)
+    mock_llm = agent.llm
+    mock_llm.stream.side_effect = lambda messages: iter([
+        mock_llm_response('Sure: {"allowed": false, '),
+        mock_llm_response('"note": "no"} Hope that helps!'),
+    ])
+
+    result = await Runner.run(agent, "judge this")
+
+    assert result.final_output == VerdictOutput(allowed=False, note="no")
+    assert mock_llm.stream.call_count == 1
+
+@pytest.mark.asyncio
+async def test_runner_structured_output_retries_on_truncated_stream(mock_chat_ollama, mock_llm_response):
+    agent = Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput)
+    mock_llm = agent.llm
+    mock_llm.stream.side_effect = [
+        iter([mock_llm_response('{"allowed": true, "note": "o')]),
+        iter([mock_llm_response('{"allowed": true, "note": "ok"}')]),
+    ]
+
+    result = await Runner.run(agent, "judge this")
+
+    assert result.final_output.note == "ok"
+    assert "stream ended" in mock_llm.stream.call_args[0][0][-1].content
+
+@pytest.mark.asyncio
+async def test_runner_structured_output_does_not_retry_client_errors(mock_chat_ollama):
+    agent = Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput)
+    mock_llm = agent.llm
+    def _stream(messages):
+        raise ValueError("connection reset")
+        yield
+    mock_llm.stream.side_effect = _stream
+
+    with pytest.raises(ValueError, match="connection reset"):
+        await Runner.run(agent, "judge this")
+    assert mock_llm.stream.call_count == 1
+
+def test_agent_rejects_unknown_decisive_fields(mock_chat_ollama):
+    with pytest.raises(ValueError, match="is_block"):
+        Agent(name="JsonAgent", instructions="Judge", output_type=VerdictOutput, decisive_fields=["is_block"])
+    with pytest.raises(ValueError, match="output_type"):
+        Agent(name="ChatAgent", instructions="Chat", decisive_fields=["allowed"])
+
+# --- Test Sessions ---
+
+@pytest.mark.asyncio
+async def test_runner_session_carries_history(mock_chat_ollama):
+    agent = Agent(name="ChatAgent", instructions="Chat")
+    mock_llm = agent.llm
+    mock_llm.invoke.side_effect = [AIMessage(content="Hi, I'm Data."), AIMessage(content="You asked who I am.")]
+    session = Session()
+
+    await Runner.run(agent, "Who are you?", session=session)
+    result = await Runner.run(agent, "What did I ask?", session=session)
+
+    assert result.final_output == "You asked who I am."
+    # invoke() sees the live message list, so ignore the reply appended afterwards
+    second_prompt = mock_llm.invoke.call_args_list[1][0][0][:4]
+    assert [m.content for m in second_prompt] == ["Chat", "Who are you?", "Hi, I'm Data.", "What did I ask?"]
+    assert len(session.stats) == 2
+
+def _usage(input_tokens):
+    return {"input_tokens": input_tokens, "output_tokens": 1, "total_tokens": input_tokens + 1}
+
+@pytest.mark.asyncio
+async def test_runner_session_truncates_tool_output_before_first_send(mock_chat_ollama):
+    agent = Agent(name="ToolAgent", instructions="Use tools", tools=[simple_tool])
+    mock_llm = agent.llm
+    mock_llm.invoke.side_effect = [
+        AIMessage(content="", tool_calls=[{"name": "simple_tool", "args": {"arg": "data"}, "id": "call_1"}],
+                  usage_metadata=_usage(10)),
+        AIMessage(content="Done", usage_metadata=_usage(20)),
+    ]
+    session = Session(max_tool_chars=5)
+
+    await Runner.run(agent, "process data", session=session)
+
+    sent_tool_msg = mock_llm.invoke.call_args_list[1][0][0][3]
+    assert sent_tool_msg.content == "Proce\n...[truncated 9 chars]"
+    # What was sent is exactly what later turns will re-send
+    assert session.history[2].content == sent_tool_msg.content
+    assert session.stats[0].reported_prompt_tokens == [10, 20]
+
+@pytest.mark.asyncio
+async def test_runner_handoff_keeps_message_prefix(mock_chat_ollama):
+    calculator = Agent(name="Calculator", instructions="Calc")
+    router = Agent(name="Router", instructions="Route", handoffs=[calculator])
+    mock_llm = router.llm
+    mock_llm.invoke.side_effect = [
+        AIMessage(content="", tool_calls=[{"name": "Calculator", "args": {}, "id": "call_1"}]),
+        AIMessage(content="42"),
+    ]
+
+    result = await Runner.run(router, "6*7")
+
+    assert result.final_output == "42"
+    assert result.last_agent == calculator
+    first_prompt, second_prompt = [c[0][0] for c in mock_llm.invoke.call_args_list]
+    # The message list is extended in place, never rebuilt
+    assert second_prompt is first_prompt
+    assert second_prompt[0].content == "Route"
+    assert second_prompt[3].tool_call_id == "call_1"
+    assert "Calc" in second_prompt[3].content
+
+@pytest.mark.asyncio
+async def test_runner_session_follow_up_after_handoff(mock_chat_ollama):
+    calculator = Agent(name="Calculator", instructions="Calc")
+    router = Agent(name="Router", instructions="Route", handoffs=[calculator])
+    mock_llm = router.llm
+    mock_llm.invoke.side_effect = [
+        AIMessage(content="", tool_calls=[{"name": "Calculator", "args": {}, "id": "call_1"}]),
+        AIMessage(content="42"),
+        AIMessage(content="You asked for 6*7."),
+    ]
+    session = Session()
+
+    await Runner.run(router, "6*7", session=session)
+    handoff_prompt = mock_llm.invoke.call_args_list[1][0][0]
+    assert "Calc" in handoff_prompt[3].content
+    await Runner.run(router, "What did I ask?", session=session)
+
+    # The follow-up sees a neutral marker, not the Calculator's instructions
+    follow_up = mock_llm.invoke.call_args_list[2][0][0]
+    assert follow_up[0].content == "Route"
+    assert [m.content for m in follow_up[1:6]] == ["6*7", "", "Transferred to Calculator.", "42", "What did I ask?"]
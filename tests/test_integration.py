@@ -21,8 +21,8 @@ async def test_data_agent_blocked_input(mock_agent_llm, mock_llm_response):
     # It expects JSON output.
     guardrail_response_json = '{"is_blocked": true, "reasoning": "Mentioned Tasha Yar"}'
     
-    # Configure Guardrail LLM to return this
-    mock_guard_llm.invoke.return_value = mock_llm_response(guardrail_response_json)
+    # Configure Guardrail LLM to stream this
+    mock_guard_llm.stream.return_value = iter([mock_llm_response(guardrail_response_json)])
 
     with pytest.raises(InputGuardrailTripwireTriggered):
         await Runner.run(data_agent, "Tell me about Tasha Yar")
@@ -33,7 +33,7 @@ async def test_data_agent_allowed_input(mock_agent_llm, mock_llm_response):
     
     # 1. Guardrail runs and allows
     guardrail_response_json = '{"is_blocked": false, "reasoning": "Safe"}'
-    mock_guard_llm.invoke.return_value = mock_llm_response(guardrail_response_json)
+    mock_guard_llm.stream.return_value = iter([mock_llm_response(guardrail_response_json)])
     
     # 2. Data agent runs
     data_response_text = "I am fully functional."
@@ -42,3 +42,21 @@ async def test_data_agent_allowed_input(mock_agent_llm, mock_llm_response):
     result = await Runner.run(data_agent, "Status report")
     
     assert result.final_output == data_response_text
+
+@pytest.mark.asyncio
+async def test_guardrail_stops_streaming_after_decision(mock_agent_llm, mock_llm_response):
+    mock_data_llm, mock_guard_llm = mock_agent_llm
+
+    chunks = ['{"is_blocked": ', 'true,', ' "reasoning": "Mentions', ' Lt. Yar"}']
+    consumed = []
+    def _stream(messages):
+        for c in chunks:
+            consumed.append(c)
+            yield mock_llm_response(c)
+    mock_guard_llm.stream.side_effect = _stream
+
+    with pytest.raises(InputGuardrailTripwireTriggered):
+        await Runner.run(data_agent, "Tell me about Lt. Yar")
+
+    # The free-text reasoning is never generated
+    assert consumed == chunks[:2]
@@ -0,0 +1,56 @@
+import json
+import pytest
+from core.json_stream import IncrementalJSONParser
+
+def test_fields_complete_incrementally():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"is_blocked": tr') == {}
+    assert parser.feed('ue, "reasoning": "a, b') == {"is_blocked": True}
+    assert parser.has_fields(["is_blocked"])
+    assert not parser.done
+    assert parser.feed('"}') == {"reasoning": "a, b"}
+    assert parser.done
+
+def test_nested_values_and_escapes():
+    parser = IncrementalJSONParser()
+    text = '{"a": {"b": [1, {"c": "}"}]}, "d": "say \\"hi\\"", "e": null}'
+    for ch in text:
+        parser.feed(ch)
+    assert parser.fields == json.loads(text)
+    assert parser.done
+
+def test_ignores_text_after_object():
+    parser = IncrementalJSONParser()
+    parser.feed('{"x": 1} trailing')
+    assert parser.fields == {"x": 1}
+    assert parser.feed('{"y": 2}') == {}
+
+def test_invalid_value_raises():
+    parser = IncrementalJSONParser()
+    with pytest.raises(json.JSONDecodeError):
+        parser.feed('{"x": nope,')
+
+def test_leading_prose_is_skipped():
+    parser = IncrementalJSONParser()
+    parser.feed('Sure: {"x": 1}')
+    assert parser.fields == {"x": 1}
+    assert parser.done
+
+@pytest.mark.parametrize("text", [
+    '{"a" 1, "b": 2}',   # missing colon
+    '{"a": 1,}',         # trailing comma
+    '} {"a": 1}',        # stray closer before the object
+    '{"a": 1, 2}',       # non-string key
+    '{"a": [1}',         # mismatched bracket in value
+])
+def test_malformed_structure_raises(text):
+    parser = IncrementalJSONParser()
+    with pytest.raises(json.JSONDecodeError):
+        parser.feed(text)
+
+def test_invalid_value_error_position_is_absolute():
+    parser = IncrementalJSONParser()
+    with pytest.raises(json.JSONDecodeError) as exc:
+        parser.feed('{"ok": 1, "x": nope}')
+    assert exc.value.pos == parser.text.index("nope")
+    assert exc.value.doc == parser.text
@@ -0,0 +1,88 @@
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
+from core.session import Session, estimate_tokens, estimate_message_tokens
+
+def _turn(question, answer):
+    return [HumanMessage(content=question), AIMessage(content=answer)]
+
+def test_build_messages_keeps_prefix_stable():
+    session = Session()
+    session.add_turn("sys", _turn("q1", "a1"), 0, [])
+    first = session.build_messages("sys", "q2")
+    session.add_turn("sys", _turn("q2", "a2"), 0, [])
+    second = session.build_messages("sys", "q3")
+
+    # The previous request (minus its new input) is a prefix of the next one
+    assert [m.content for m in second[:len(first) - 1]] == [m.content for m in first[:-1]]
+    assert [m.content for m in second] == ["sys", "q1", "a1", "q2", "a2", "q3"]
+
+def test_truncate_tool_output():
+    session = Session(max_tool_chars=10)
+    assert session.truncate_tool_output("short") == "short"
+    assert session.truncate_tool_output("x" * 50) == "x" * 10 + "\n...[truncated 40 chars]"
+
+def test_history_trimmed_to_half_budget():
+    session = Session(max_history_tokens=12)
+    for i in range(3):
+        session.add_turn("sys", _turn("q" * 8, f"a{i}" * 4), 0, [])  # 2 + 2 tokens per turn
+    assert session.history_tokens == 12
+
+    # Going over budget drops the oldest turns down to half the budget
+    session.add_turn("sys", _turn("q" * 8, "z" * 8), 0, [])
+    assert session.history_tokens == 4
+    assert [m.content for m in session.history] == ["q" * 8, "z" * 8]
+
+def test_latest_turn_kept_when_over_half_budget():
+    session = Session(max_history_tokens=12)
+    session.add_turn("sys", _turn("q1", "a1"), 0, [])
+    session.add_turn("sys", _turn("q2", "b" * 40), 0, [])  # 11 tokens on its own
+
+    assert [m.content for m in session.history] == ["q2", "b" * 40]
+
+def test_summarizer_replaces_dropped_turns():
+    calls = []
+    def summarize(previous, dropped):
+        calls.append((previous, [m.content for m in dropped]))
+        return "asked about q1"
+
+    session = Session(max_history_tokens=12, summarizer=summarize)
+    session.add_turn("sys", _turn("q1", "a" * 28), 0, [])
+    session.add_turn("sys", _turn("q2", "b" * 16), 0, [])
+
+    assert calls == [(None, ["q1", "a" * 28])]
+    assert isinstance(session.history[0], SystemMessage)
+    assert "asked about q1" in session.history[0].content
+    assert [m.content for m in session.history[1:]] == ["q2", "b" * 16]
+
+def test_oversized_summary_rechecked_against_budget():
+    session = Session(max_history_tokens=12, summarizer=lambda previous, dropped: "s" * 200)
+    session.add_turn("sys", _turn("q1", "a1"), 0, [])
+    session.add_turn("sys", _turn("q2", "a2"), 0, [])
+    session.add_turn("sys", _turn("q3", "c" * 36), 0, [])
+
+    assert session.history_tokens <= 12
+    assert [m.content for m in session.history] == ["q3", "c" * 36]
+
+def test_stats_compare_sent_and_untrimmed_prompts():
+    session = Session(max_tool_chars=4)
+    tool_output = session.truncate_tool_output("y" * 400)
+    first_prompt = session.build_messages("sys", "q1")
+    session.add_turn("sys", [
+        HumanMessage(content="q1"),
+        ToolMessage(content=tool_output, tool_call_id="call_1"),
+        AIMessage(content="a1"),
+    ], estimate_message_tokens(first_prompt), [12, 40])
+    second_prompt = session.build_messages("sys", "q2")
+    session.add_turn("sys", _turn("q2", "a2"), estimate_message_tokens(second_prompt), [30])
+
+    first, second = session.stats
+    assert first.prompt_tokens == first.untrimmed_prompt_tokens
+    assert first.reported_prompt_tokens == [12, 40]
+    # Untrimmed history counts the full tool output, not the truncated copy
+    assert second.untrimmed_prompt_tokens - second.prompt_tokens == (
+        estimate_tokens("y" * 400) - estimate_tokens(tool_output)
+    )
+    assert second.reported_prompt_tokens == [30]
+
+def test_estimate_counts_tool_call_arguments():
+    call = AIMessage(content="", tool_calls=[{"name": "web_search", "args": {"query": "q" * 40}, "id": "call_1"}])
+    assert estimate_message_tokens([call]) > 10